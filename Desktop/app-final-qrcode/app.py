@@ -1,30 +1,18 @@
 import warnings
 import os
+import base64
 import re
-import io
-import json
+import tempfile
+from dataclasses import dataclass
 import streamlit as st
-import openai
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import orjson
 import requests
-from PIL import Image
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import (
-    SimpleDocTemplate,
-    Paragraph,
-    Spacer,
-    ListFlowable,
-    ListItem,
-    Image as RLImage,
-    PageBreak
-)
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER, TA_LEFT
-from reportlab.lib.units import inch
-import pandas as pd
-import altair as alt
-import matplotlib.pyplot as plt
-from matplotlib import rcParams
 
 # Ignore all deprecation warnings
 warnings.filterwarnings("ignore", category=DeprecationWarning)
@@ -36,7 +24,10 @@ try:
 except KeyError:
     st.error("API key for OpenAI not found in secrets.")
 
-openai.api_key = OPENAI_API_KEY
+# OpenAI models: a small, fast one for chat and concept descriptions and a larger
+# one for long-form content (learning paths, exam questions). Overridable in secrets.
+CHAT_MODEL = st.secrets.get("OPENAI_CHAT_MODEL", "gpt-4o-mini")
+CONTENT_MODEL = st.secrets.get("OPENAI_CONTENT_MODEL", "gpt-4o")
 
 # API URLs
 API_AUTH_URL_ENGLISH = "https://webapi.edubull.com/api/EnglishLab/Auth_with_topic_for_chatbot"
@@ -44,11 +35,52 @@ API_AUTH_URL_MATH_SCIENCE = "https://webapi.edubull.com/api/eProfessor/eProf_Org
 API_CONTENT_URL = "https://webapi.edubull.com/api/eProfessor/WeakConcept_Remedy_List_ByConceptID"
 API_TEACHER_WEAK_CONCEPTS = "https://webapi.edubull.com/api/eProfessor/eProf_Org_Teacher_Topic_Wise_Weak_Concepts"
 
+# (connect, read) timeout for Edubull API calls; connect is just over the 3 s TCP retransmit window
+_API_TIMEOUT = (3.05, 15)
+
+# Precompiled patterns used when splitting generated text for the PDFs
+_LATEX_RE = re.compile(r'\$\$(.*?)\$\$|\$(.*?)\$', re.DOTALL)
+_PARA_RE = re.compile(r'\n\n')
+# Chat questions asking for learning material
+_RESOURCE_REQUEST_RE = re.compile(r'resource|material|video|note|exercise', re.IGNORECASE)
+# Math simple enough to set as text (x, 5, 2x + 1 = 7, x^2, a^{n+1})
+_TRIVIAL_MATH_RE = re.compile(r'(?:[A-Za-z0-9+\-*/=().,\s]|\^(?:[A-Za-z0-9]|\{[A-Za-z0-9+\-]+\}))+')
+_SUPERSCRIPT_RE = re.compile(r'\^(?:\{([^}]*)\}|(.))')
+
+# Resolution LaTeX is rasterized at; images are placed at their natural size
+_LATEX_DPI = 200
+
+# Invariant part of the exam-question prompt. Kept as a fixed system message
+# ahead of the per-request details so OpenAI can reuse its cached prefix.
+EXAM_QUESTIONS_SYSTEM_PROMPT = (
+    "You are an educational AI assistant helping a teacher create exam questions for a concept, "
+    "for students following the NCERT curriculum.\n"
+    "Generate a set of 20 challenging and thought-provoking exam questions related to the concept.\n"
+    "Generated questions should be aligned with NEP 2020 and NCF guidelines.\n"
+    "Vary in difficulty.\n"
+    "Encourage critical thinking.\n"
+    "Be clearly formatted and numbered.\n\n"
+    "Do not provide the answers, only the questions.\n"
+    "Ensure that all mathematical expressions are enclosed within LaTeX delimiters (`$...$` for inline "
+    "and `$$...$$` for display).\n"
+    "Focus on the Bloom's Taxonomy level given by the teacher.\n"
+    "Label each question clearly with that level in bold parentheses at the end of the question, e.g. **(L4)**.\n"
+)
+
+# Chat messages sent to OpenAI with each question (the last 20 chat messages;
+# resource messages are stored as extra assistant entries, so this can cover
+# fewer than 10 exchanges)
+_CHAT_HISTORY_MESSAGES = 20
+
+# PDFs larger than this are spooled to a temporary file while being built
+_PDF_SPOOL_MAX_SIZE = 2 * 1024 * 1024
+# Indent of the numbered exam question list, also subtracted from the width
+# its math images may take
+_LIST_INDENT = 18
+
 # Initialize session states if not present
 if "auth_data" not in st.session_state:
     st.session_state.auth_data = None
-if "selected_concept_id" not in st.session_state:
-    st.session_state.selected_concept_id = None
 if "conversation_history" not in st.session_state:
     st.session_state.conversation_history = []
 if "is_authenticated" not in st.session_state:
@@ -61,6 +93,7 @@ if "topic_id" not in st.session_state:
     st.session_state.topic_id = None
 if "teacher_weak_concepts" not in st.session_state:
     st.session_state.teacher_weak_concepts = []
+    st.session_state.teacher_concept_map = {}  # ConceptText -> ConceptID for the selected batch
 if "selected_batch_id" not in st.session_state:
     st.session_state.selected_batch_id = None
 if "exam_questions" not in st.session_state:
@@ -68,16 +101,25 @@ if "exam_questions" not in st.session_state:
 if "learning_path_generated" not in st.session_state:
     st.session_state.learning_path_generated = False
     st.session_state.learning_path = None
-if "generated_description" not in st.session_state:
-    st.session_state.generated_description = ""
 if "is_english_mode" not in st.session_state:
     st.session_state.is_english_mode = False  # default initialization
+if "prepared_pdfs" not in st.session_state:
+    st.session_state.prepared_pdfs = {}  # download key -> text the PDF was prepared from
 if "student_learning_paths" not in st.session_state:
     st.session_state.student_learning_paths = {}  # Dictionary to store multiple learning paths
 if "student_weak_concepts" not in st.session_state:
     st.session_state.student_weak_concepts = []
 if "available_concepts" not in st.session_state:
     st.session_state.available_concepts = {}
+if "initial_greeting" not in st.session_state:
+    st.session_state.initial_greeting = ""
+if "concept_resources" not in st.session_state:
+    st.session_state.concept_resources = {}  # ConceptID -> raw resource lists, prefetched at login
+if "pending_user_input" not in st.session_state:
+    st.session_state.pending_user_input = None
+if "concept_ids_by_text" not in st.session_state:
+    st.session_state.concept_ids_by_text = {}  # concept_key(ConceptText) -> ConceptID
+    st.session_state.concept_regex = None  # matches any ConceptText in a chat message
 
 # Page config
 st.set_page_config(
@@ -98,169 +140,446 @@ hide_st_style = """
 st.markdown(hide_st_style, unsafe_allow_html=True)
 
 # Helper function to convert LaTeX to image
-def latex_to_image(latex_code, dpi=300):
+@st.cache_data(max_entries=512, show_spinner=False)
+def render_latex_png(latex_code, dpi=_LATEX_DPI):
+    """
+    Renders LaTeX code to 1-bit PNG bytes. Rendering goes through matplotlib's
+    mathtext engine directly, so no pyplot figure/axes state is created per
+    expression, and repeated expressions (x, x^2, ...) are rendered once.
+    """
+    # Imported lazily: matplotlib is only needed once someone builds a PDF
+    from matplotlib import mathtext
+    from matplotlib.font_manager import FontProperties
+    from PIL import Image
+
+    buf = BytesIO()
+    mathtext.math_to_image(f"${latex_code}$", buf, prop=FontProperties(size=12), dpi=dpi, format='png')
+    buf.seek(0)
+    # Math is black on white, so a 1-bit PNG is enough and a fraction of the RGBA size
+    img = Image.open(buf).convert('L').point(lambda p: 0 if p < 128 else 255, mode='1')
+    buf = BytesIO()
+    img.save(buf, format='PNG', optimize=True)
+    return buf.getvalue()
+
+def latex_to_image(latex_code, dpi=_LATEX_DPI):
     """
     Converts LaTeX code to a PNG image and returns it as a BytesIO object.
+    Each call gets a fresh buffer over the cached bytes, since ReportLab
+    consumes the buffer it is given.
     """
     try:
-        # Adjust figure size based on display or inline math
-        plt.figure(figsize=(0.01, 0.01))
-        plt.text(0.5, 0.5, f"${latex_code}$", fontsize=12, ha='center', va='center')
-        plt.axis('off')
-        buf = BytesIO()
-        plt.savefig(buf, format='png', dpi=dpi, bbox_inches='tight', pad_inches=0.1, transparent=True)
-        plt.close()
-        buf.seek(0)
-        return buf
+        return BytesIO(render_latex_png(latex_code, dpi))
     except Exception as e:
         st.error(f"Error converting LaTeX to image: {e}")
         return None
 
-def get_matching_resources(concept_text, concept_list, topic_id):
+def latex_to_markup(latex_code):
     """
-    Find matching concept ID from the main concept list and fetch its resources.
+    Returns ReportLab paragraph markup for trivial math, or None when the
+    expression has to be rendered as an image.
     """
-    # Clean and normalize concept texts for comparison
-    def clean_text(text):
-        return text.lower().strip().replace(" ", "")
-    
-    clean_weak_concept = clean_text(concept_text)
-    
-    # Find matching concept from the main concept list
-    matching_concept = next(
-        (c for c in concept_list if clean_text(c['ConceptText']) == clean_weak_concept),
-        None
+    if not _TRIVIAL_MATH_RE.fullmatch(latex_code):
+        return None
+    markup = _SUPERSCRIPT_RE.sub(lambda m: f"<super>{m.group(1) or m.group(2)}</super>", latex_code)
+    return f"<i>{markup}</i>"
+
+@st.cache_resource
+def get_http_session():
+    """
+    Shared HTTP session for the Edubull API, created once per process so
+    calls reuse keep-alive connections across reruns and users.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=10,
+        pool_maxsize=20,
+        # POSTs are retried only when the server never saw them (connect errors)
+        # or refused them (status codes). read=False re-raises a read timeout
+        # at once, as requests' Timeout, rather than sending the POST again.
+        max_retries=Retry(
+            total=3,
+            connect=3,
+            read=False,
+            status=3,
+            backoff_factor=0.3,
+            status_forcelist=[429, 502, 503, 504],
+            allowed_methods=frozenset({"GET", "POST"}),
+        )
     )
-    
-    if matching_concept:
-        content_payload = {
-            'TopicID': topic_id,
-            'ConceptID': int(matching_concept['ConceptID'])
-        }
-        headers = {
-            "Content-Type": "application/json",
-            "User-Agent": "Mozilla/5.0",
-            "Accept": "application/json"
-        }
-        
+    session.mount("https://", adapter)
+    session.headers.update({
+        "Content-Type": "application/json",
+        "User-Agent": "Mozilla/5.0",
+        "Accept": "application/json"
+    })
+    return session
+
+@st.cache_resource
+def get_openai_client():
+    """
+    Configure the OpenAI SDK once per process. Connections are left to the
+    SDK: it keeps one session per script thread (reused across reruns),
+    mounts its own connection retries and recycles each session every few
+    minutes. A shared openai.requestssession would be closed from under
+    every other thread by that recycling.
+    """
+    # Imported lazily: the SDK is slow to import and the login page never needs it
+    import openai
+
+    openai.api_key = OPENAI_API_KEY
+    return openai
+
+def stream_completion(spinner_text, **kwargs):
+    """
+    Stream a chat completion, showing a spinner only until the first chunk
+    arrives; after that the streamed text itself shows progress.
+    """
+    with st.spinner(spinner_text):
+        response = get_openai_client().ChatCompletion.create(stream=True, **kwargs)
+        first_chunk = next(response, None)
+    if first_chunk is not None:
+        yield first_chunk
+        yield from response
+
+@st.cache_data(ttl=3600, max_entries=256, show_spinner=False)
+def _cached_chat(model, messages, max_tokens, temperature=1):
+    """
+    Run a ChatCompletion and cache the reply text.
+    `messages` is a tuple of (role, content) pairs so it can be hashed; identical
+    prompts on later reruns are answered from the cache instead of OpenAI.
+    max_entries bounds memory, since every distinct prompt from every user
+    adds an entry.
+    """
+    response = get_openai_client().ChatCompletion.create(
+        model=model,
+        messages=[{"role": role, "content": content} for role, content in messages],
+        max_tokens=max_tokens,
+        temperature=temperature
+    )
+    return response.choices[0].message['content'].strip()
+
+@st.cache_data(ttl=3600, max_entries=512, show_spinner=False)
+def fetch_resources_by_concept_id(topic_id, concept_id):
+    """
+    Fetch the videos/notes/exercises for a concept from the Edubull API.
+    Cached per (topic_id, concept_id) for an hour since the lists rarely change;
+    max_entries bounds memory across all topics served by the process.
+    """
+    content_payload = {
+        'TopicID': topic_id,
+        'ConceptID': int(concept_id)
+    }
+    response = get_http_session().post(API_CONTENT_URL, json=content_payload, timeout=_API_TIMEOUT)
+    response.raise_for_status()
+    return orjson.loads(response.content)
+
+@st.cache_data(ttl=300, show_spinner=False)
+def fetch_weak_concepts(batch_id, topic_id, org_code):
+    """
+    Fetch a batch's weak concepts for the topic from the Edubull API.
+    Cached so switching back to an earlier batch does not hit the API again.
+    """
+    params = {
+        "BatchID": batch_id,
+        "TopicID": topic_id,
+        "OrgCode": org_code
+    }
+    response = get_http_session().post(API_TEACHER_WEAK_CONCEPTS, json=params, timeout=_API_TIMEOUT)
+    response.raise_for_status()
+    return orjson.loads(response.content)
+
+def script_thread_pool(max_workers):
+    """
+    ThreadPoolExecutor whose workers carry the calling script's
+    ScriptRunContext, so the st.cache_data functions they call run as part
+    of this session instead of warning about a missing context.
+    """
+    ctx = get_script_run_ctx()
+    return ThreadPoolExecutor(
+        max_workers=max_workers,
+        initializer=lambda: add_script_run_ctx(threading.current_thread(), ctx)
+    )
+
+def fetch_resources_batch(topic_id, concept_ids):
+    """
+    Fetch resources for several concepts concurrently.
+    Returns a dict of concept_id -> resources (None if the fetch failed).
+    """
+    def fetch(concept_id):
         try:
-            response = requests.post(API_CONTENT_URL, json=content_payload, headers=headers)
-            response.raise_for_status()
-            return response.json()
+            return fetch_resources_by_concept_id(topic_id, concept_id)
         except Exception as e:
             print(f"Error fetching resources: {e}")
             return None
-    
-    return None
 
-def get_resources_for_concept(concept_text, concept_list, topic_id):
+    if not concept_ids:
+        return {}
+    with script_thread_pool(min(8, len(concept_ids))) as executor:
+        return dict(zip(concept_ids, executor.map(fetch, concept_ids)))
+
+# ================= RESOURCE MODELS =================
+@dataclass(slots=True)
+class Video:
+    title: str
+    url: str  # Edubull course page for the lecture
+
+@dataclass(slots=True)
+class Note:
+    title: str
+    url: str
+
+@dataclass(slots=True)
+class Exercise:
+    title: str
+    url: str
+
+@dataclass(slots=True)
+class ResourceBundle:
+    videos: list
+    notes: list
+    exercises: list
+
+    def __bool__(self):
+        return bool(self.videos or self.notes or self.exercises)
+
+def parse_resources(content_data):
     """
-    Fetch resources for a given concept text.
-    Returns the resources data if found, None otherwise.
+    Convert a WeakConcept_Remedy_List response into a ResourceBundle once, so
+    rendering code reads attributes instead of repeating dict lookups per field.
     """
-    # Clean and normalize concept texts for comparison
-    def clean_text(text):
-        return text.lower().strip().replace(" ", "")
-    
-    clean_concept = clean_text(concept_text)
-    
-    # Find matching concept from the concept list
-    matching_concept = next(
-        (c for c in concept_list if clean_text(c['ConceptText']) == clean_concept),
-        None
+    videos = []
+    for video in content_data.get("Video_List") or []:
+        url = f"https://www.edubull.com/courses/videos/{video.get('LectureID', '')}"
+        videos.append(Video(video.get('LectureTitle', 'Video Lecture'), url))
+    notes = [
+        Note(note.get('NotesTitle', 'Study Notes'), f"{note.get('FolderName', '')}{note.get('PDFFileName', '')}")
+        for note in content_data.get("Notes_List") or []
+    ]
+    exercises = [
+        Exercise(exercise.get('ExerciseTitle', 'Practice Exercise'), f"{exercise.get('FolderName', '')}{exercise.get('ExerciseFileName', '')}")
+        for exercise in content_data.get("Exercise_List") or []
+    ]
+    return ResourceBundle(videos, notes, exercises)
+
+def concept_key(text):
+    """
+    Clean and normalize a concept text so it can be compared with others.
+    """
+    return text.lower().strip().replace(" ", "")
+
+def index_concepts(concept_list):
+    """
+    Build the concept lookups kept in session state after login.
+    """
+    st.session_state.concept_ids_by_text = {concept_key(c['ConceptText']): c['ConceptID'] for c in concept_list}
+    st.session_state.available_concepts = {c['ConceptText']: c['ConceptID'] for c in concept_list}
+    # One alternation, longest first so the most specific overlapping concept wins
+    texts = sorted({c['ConceptText'] for c in concept_list if c['ConceptText']}, key=len, reverse=True)
+    st.session_state.concept_regex = (
+        re.compile('|'.join(map(re.escape, texts)), re.IGNORECASE) if texts else None
     )
-    
-    if matching_concept:
-        content_payload = {
-            'TopicID': topic_id,
-            'ConceptID': int(matching_concept['ConceptID'])
-        }
-        headers = {
-            "Content-Type": "application/json",
-            "User-Agent": "Mozilla/5.0",
-            "Accept": "application/json"
-        }
-        
+
+def load_concept_resources(topic_id, concept_id):
+    """
+    Resources for a concept as a ResourceBundle, taken from the login-time
+    prefetch when available and fetched otherwise. None if the fetch fails.
+    """
+    content_data = st.session_state.concept_resources.get(concept_id)
+    if content_data is None:
         try:
-            response = requests.post(API_CONTENT_URL, json=content_payload, headers=headers)
-            response.raise_for_status()
-            return response.json()
+            content_data = fetch_resources_by_concept_id(topic_id, concept_id)
         except Exception as e:
             print(f"Error fetching resources: {e}")
             return None
-    
+    return parse_resources(content_data)
+
+def get_matching_resources(concept_text, topic_id):
+    """
+    Find matching concept ID from the main concept list and fetch its resources.
+    """
+    concept_id = st.session_state.concept_ids_by_text.get(concept_key(concept_text))
+    if concept_id is not None:
+        return load_concept_resources(topic_id, concept_id)
     return None
 
 def format_resources_message(resources):
     """
-    Format resources data into a chat-friendly message.
+    Format a ResourceBundle into a chat-friendly message.
     """
     message = "Here are the available resources for this concept:\n\n"
     
-    if resources.get("Video_List"):
+    if resources.videos:
         message += "**🎥 Video Lectures:**\n"
-        for video in resources["Video_List"]:
-            video_url = f"https://www.edubull.com/courses/videos/{video.get('LectureID', '')}"
-            message += f"- [{video.get('LectureTitle', 'Video Lecture')}]({video_url})\n"
+        for video in resources.videos:
+            message += f"- [{video.title}]({video.url})\n"
         message += "\n"
     
-    if resources.get("Notes_List"):
+    if resources.notes:
         message += "**📄 Study Notes:**\n"
-        for note in resources["Notes_List"]:
-            note_url = f"{note.get('FolderName', '')}{note.get('PDFFileName', '')}"
-            message += f"- [{note.get('NotesTitle', 'Study Notes')}]({note_url})\n"
+        for note in resources.notes:
+            message += f"- [{note.title}]({note.url})\n"
         message += "\n"
     
-    if resources.get("Exercise_List"):
+    if resources.exercises:
         message += "**📝 Practice Exercises:**\n"
-        for exercise in resources["Exercise_List"]:
-            exercise_url = f"{exercise.get('FolderName', '')}{exercise.get('ExerciseFileName', '')}"
-            message += f"- [{exercise.get('ExerciseTitle', 'Practice Exercise')}]({exercise_url})\n"
+        for exercise in resources.exercises:
+            message += f"- [{exercise.title}]({exercise.url})\n"
     
     return message
 
 # ================= PDF GENERATION FUNCTIONS =================
+@st.cache_resource
+def _pdf_styles():
+    """
+    Build the ReportLab paragraph styles once per process; they never change
+    between PDFs, so there is no need to rebuild the sample stylesheet per call.
+    """
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER, TA_LEFT
+
+    styles = getSampleStyleSheet()
+    return {
+        'title': ParagraphStyle(
+            'CustomTitle',
+            parent=styles['Heading1'],
+            fontName='Helvetica-Bold',
+            fontSize=16,
+            alignment=TA_CENTER,
+            spaceAfter=12
+        ),
+        'subtitle': ParagraphStyle(
+            'CustomSubtitle',
+            parent=styles['Heading2'],
+            fontName='Helvetica',
+            fontSize=12,
+            alignment=TA_CENTER,
+            spaceAfter=12
+        ),
+        'section_title': ParagraphStyle(
+            'SectionTitle',
+            parent=styles['Heading2'],
+            fontName='Helvetica-Bold',
+            fontSize=14,
+            alignment=TA_LEFT,
+            spaceAfter=8
+        ),
+        'question': ParagraphStyle(
+            'QuestionStyle',
+            parent=styles['Normal'],
+            fontName='Helvetica',
+            fontSize=10,
+            alignment=TA_JUSTIFY,
+            spaceAfter=6
+        ),
+        'content': ParagraphStyle(
+            'CustomNormal',
+            parent=styles['Normal'],
+            fontName='Helvetica',
+            fontSize=10,
+            alignment=TA_JUSTIFY,
+            spaceAfter=6
+        ),
+        'section_heading': styles['Heading3'],
+    }
+
+def _math_image(img_buffer, display_math, max_width):
+    """
+    Places a rendered LaTeX image at its natural size (display math a little
+    larger) instead of stretching it into a fixed box. Images wider than
+    max_width are scaled down to fit, keeping their aspect ratio.
+    """
+    from reportlab.platypus import Image as RLImage
+
+    img = RLImage(img_buffer)
+    scale = 72 / _LATEX_DPI * (1.25 if display_math else 1)
+    scale = min(scale, max_width / img.imageWidth)
+    img.drawWidth = img.imageWidth * scale
+    img.drawHeight = img.imageHeight * scale
+    return img
+
+def _pdf_sections(text):
+    """
+    Split generated text into (heading, lines) sections on blank lines,
+    dropping empty lines and empty sections.
+    """
+    for section in _PARA_RE.split(text.strip()):
+        lines = [line.strip() for line in section.split('\n') if line.strip()]
+        if lines:
+            yield lines[0], lines[1:]
+
+def _line_flowables(line, style, max_width):
+    """
+    Lay out one line containing LaTeX as Paragraphs and math images no wider
+    than max_width.
+    Returns None for a plain-text line so callers can group those themselves.
+    """
+    from reportlab.platypus import Paragraph
+
+    # Detect LaTeX expressions in the line
+    latex_matches = list(_LATEX_RE.finditer(line))
+    if not latex_matches:
+        return None
+    parts = []
+    # Text (and trivial math set as text) waiting to become a Paragraph
+    text = ""
+    # Keep track of the last index processed
+    last_index = 0
+    for match in latex_matches:
+        if match.group(1):
+            # Display math
+            latex = match.group(1).strip()
+            display_math = True
+        else:
+            # Inline math
+            latex = match.group(2).strip()
+            display_math = False
+
+        if latex:
+            # Add text before LaTeX
+            text += line[last_index:match.start()]
+            # Update last_index
+            last_index = match.end()
+
+            # Simple inline math stays in the text, no image needed
+            markup = None if display_math else latex_to_markup(latex)
+            if markup:
+                text += markup
+                continue
+            if text:
+                parts.append(Paragraph(text, style))
+                text = ""
+
+            # Convert LaTeX to image
+            img_buffer = latex_to_image(latex)
+            if img_buffer:
+                parts.append(_math_image(img_buffer, display_math, max_width))
+
+    # Add remaining text after last LaTeX
+    text += line[last_index:]
+    if text:
+        parts.append(Paragraph(text, style))
+    return parts
+
+@st.cache_data(max_entries=64, show_spinner=False)
 def generate_exam_questions_pdf(questions, concept_text, user_name):
-    buffer = io.BytesIO()
+    """
+    Build the exam questions PDF. Cached on its text arguments, so reruns
+    after the questions are generated reuse the same bytes.
+    """
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, ListFlowable, ListItem
+
+    # Small PDFs stay in memory, large ones (many LaTeX images) spill to disk
+    buffer = tempfile.SpooledTemporaryFile(max_size=_PDF_SPOOL_MAX_SIZE, mode='w+b')
     doc = SimpleDocTemplate(buffer, pagesize=letter,
                             rightMargin=72, leftMargin=72,
                             topMargin=72, bottomMargin=18)
     story = []
-    styles = getSampleStyleSheet()
-
-    # Define custom styles
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontName='Helvetica-Bold',
-        fontSize=16,
-        alignment=TA_CENTER,
-        spaceAfter=12
-    )
-    subtitle_style = ParagraphStyle(
-        'CustomSubtitle',
-        parent=styles['Heading2'],
-        fontName='Helvetica',
-        fontSize=12,
-        alignment=TA_CENTER,
-        spaceAfter=12
-    )
-    section_title_style = ParagraphStyle(
-        'SectionTitle',
-        parent=styles['Heading2'],
-        fontName='Helvetica-Bold',
-        fontSize=14,
-        alignment=TA_LEFT,
-        spaceAfter=8
-    )
-    question_style = ParagraphStyle(
-        'QuestionStyle',
-        parent=styles['Normal'],
-        fontName='Helvetica',
-        fontSize=10,
-        alignment=TA_JUSTIFY,
-        spaceAfter=6
-    )
+    styles = _pdf_styles()
+    title_style = styles['title']
+    subtitle_style = styles['subtitle']
+    section_title_style = styles['section_title']
+    question_style = styles['question']
 
     # Add title and subtitle
     story.append(Paragraph("Exam Questions", title_style))
@@ -269,100 +588,49 @@ def generate_exam_questions_pdf(questions, concept_text, user_name):
     story.append(Paragraph(f"For {user_name_display} - {concept_text_display}", subtitle_style))
     story.append(Spacer(1, 12))
 
-    # Parse questions into sections
-    sections = re.split(r'\n\n', questions.strip())
-    for section in sections:
-        lines = [line.strip() for line in section.split('\n') if line.strip()]
-        if not lines:
-            continue
+    for heading, lines in _pdf_sections(questions):
         # First line as a section title
-        story.append(Paragraph(lines[0], section_title_style))
+        story.append(Paragraph(heading, section_title_style))
         story.append(Spacer(1, 8))
 
-        # Add questions as a numbered list
+        # Add questions as a numbered list, one ListItem per question line.
+        # Text and math images of a line share that item, so a question keeps one number.
         question_items = []
-        for line in lines[1:]:
-            # Detect LaTeX expressions in the line
-            latex_matches = re.finditer(r'\$\$(.*?)\$\$|\$(.*?)\$', line)
-            if latex_matches:
-                # Keep track of the last index processed
-                last_index = 0
-                for match in latex_matches:
-                    if match.group(1):
-                        # Display math
-                        latex = match.group(1).strip()
-                        display_math = True
-                    else:
-                        # Inline math
-                        latex = match.group(2).strip()
-                        display_math = False
-
-                    if latex:
-                        # Add text before LaTeX
-                        pre_text = line[last_index:match.start()]
-                        if pre_text:
-                            question_items.append(ListItem(Paragraph(pre_text, question_style)))
-
-                        # Convert LaTeX to image
-                        img_buffer = latex_to_image(latex)
-                        if img_buffer:
-                            # Adjust image size based on math type
-                            if display_math:
-                                img = RLImage(img_buffer, width=4*inch, height=1*inch)
-                            else:
-                                img = RLImage(img_buffer, width=2*inch, height=0.5*inch)
-                            question_items.append(ListItem(img))
-
-                        # Update last_index
-                        last_index = match.end()
-
-                # Add remaining text after last LaTeX
-                post_text = line[last_index:]
-                if post_text:
-                    question_items.append(ListItem(Paragraph(post_text, question_style)))
-            else:
+        for line in lines:
+            parts = _line_flowables(line, question_style, doc.width - _LIST_INDENT)
+            if parts is None:
                 # Regular text
                 question_items.append(ListItem(Paragraph(line, question_style)))
-        story.append(ListFlowable(question_items, bulletType='1'))
+            elif parts:
+                question_items.append(ListItem(parts))
+        story.append(ListFlowable(question_items, bulletType='1', leftIndent=_LIST_INDENT))
         story.append(Spacer(1, 12))
 
     doc.build(story)
-    pdf_bytes = buffer.getvalue()
+    buffer.seek(0)
+    pdf_bytes = buffer.read()
     buffer.close()
     return pdf_bytes
 
+@st.cache_data(max_entries=64, show_spinner=False)
 def generate_learning_path_pdf(learning_path, concept_text, user_name):
-    buffer = io.BytesIO()
+    """
+    Build the learning path PDF. Cached on its text arguments, so the
+    download button does not rebuild the PDF on every rerun.
+    """
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
+
+    # Small PDFs stay in memory, large ones (many LaTeX images) spill to disk
+    buffer = tempfile.SpooledTemporaryFile(max_size=_PDF_SPOOL_MAX_SIZE, mode='w+b')
     doc = SimpleDocTemplate(buffer, pagesize=letter,
                             rightMargin=72, leftMargin=72,
                             topMargin=72, bottomMargin=18)
     story = []
-    styles = getSampleStyleSheet()
-
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontName='Helvetica-Bold',
-        fontSize=16,
-        alignment=TA_CENTER,
-        spaceAfter=12
-    )
-    subtitle_style = ParagraphStyle(
-        'CustomSubtitle',
-        parent=styles['Heading2'],
-        fontName='Helvetica',
-        fontSize=12,
-        alignment=TA_CENTER,
-        spaceAfter=12
-    )
-    content_style = ParagraphStyle(
-        'CustomNormal',
-        parent=styles['Normal'],
-        fontName='Helvetica',
-        fontSize=10,
-        alignment=TA_JUSTIFY,
-        spaceAfter=6
-    )
+    styles = _pdf_styles()
+    title_style = styles['title']
+    subtitle_style = styles['subtitle']
+    content_style = styles['content']
 
     story.append(Paragraph("Personalized Learning Path", title_style))
     user_name_display = user_name if user_name else "Student"
@@ -370,74 +638,60 @@ def generate_learning_path_pdf(learning_path, concept_text, user_name):
     story.append(Paragraph(f"For {user_name_display} - {concept_text_display}", subtitle_style))
     story.append(Spacer(1, 12))
 
-    # Process each section in the learning path
-    sections = re.split(r'\n\n', learning_path.strip())
-    for section in sections:
-        lines = [line.strip() for line in section.split('\n') if line.strip()]
-        if not lines:
-            continue
+    for heading, lines in _pdf_sections(learning_path):
         # First line as section header
-        story.append(Paragraph(lines[0], styles['Heading3']))
+        story.append(Paragraph(heading, styles['section_heading']))
         story.append(Spacer(1, 6))
 
-        for line in lines[1:]:
-            # Detect LaTeX expressions in the line
-            latex_matches = re.finditer(r'\$\$(.*?)\$\$|\$(.*?)\$', line)
-            if latex_matches:
-                # Keep track of the last index processed
-                last_index = 0
-                for match in latex_matches:
-                    if match.group(1):
-                        # Display math
-                        latex = match.group(1).strip()
-                        display_math = True
-                    else:
-                        # Inline math
-                        latex = match.group(2).strip()
-                        display_math = False
-
-                    if latex:
-                        # Add text before LaTeX
-                        pre_text = line[last_index:match.start()]
-                        if pre_text:
-                            story.append(Paragraph(pre_text, content_style))
-
-                        # Convert LaTeX to image
-                        img_buffer = latex_to_image(latex)
-                        if img_buffer:
-                            # Adjust image size based on math type
-                            if display_math:
-                                img = RLImage(img_buffer, width=4*inch, height=1*inch)
-                            else:
-                                img = RLImage(img_buffer, width=2*inch, height=0.5*inch)
-                            story.append(img)
-
-                        # Update last_index
-                        last_index = match.end()
-
-                # Add remaining text after last LaTeX
-                post_text = line[last_index:]
-                if post_text:
-                    story.append(Paragraph(post_text, content_style))
-            else:
-                # Regular text
-                story.append(Paragraph(line, content_style))
+        # Consecutive plain-text lines are laid out as one Paragraph
+        text_run = []
+        for line in lines:
+            parts = _line_flowables(line, content_style, doc.width)
+            if parts is None:
+                text_run.append(line)
+                continue
+            if text_run:
+                story.append(Paragraph("<br/>".join(text_run), content_style))
+                story.append(Spacer(1, 6))
+                text_run = []
+            story.extend(parts)
+            story.append(Spacer(1, 6))
+        if text_run:
+            story.append(Paragraph("<br/>".join(text_run), content_style))
             story.append(Spacer(1, 6))
         story.append(Spacer(1, 12))
 
     doc.build(story)
-    pdf_bytes = buffer.getvalue()
+    buffer.seek(0)
+    pdf_bytes = buffer.read()
     buffer.close()
     return pdf_bytes
 
+def pdf_download_button(key, source_text, label, file_name, build_pdf):
+    """
+    Show a "Prepare PDF" button, and the download button only once the user
+    asked for the PDF, so PDFs nobody downloads are never built. Generating
+    new text for the same key asks for a fresh prepare.
+    """
+    if st.session_state.prepared_pdfs.get(key) != source_text:
+        if not st.button("📄 Prepare PDF", key=f"prepare_{key}"):
+            return
+        st.session_state.prepared_pdfs[key] = source_text
+    st.download_button(
+        label=label,
+        data=build_pdf(),
+        file_name=file_name,
+        mime="application/pdf",
+        key=f"download_{key}"
+    )
+
 # ================= LEARNING PATH GENERATION FUNCTION =================
-def generate_learning_path(concept_text):
+def learning_path_prompt(concept_text, branch_name):
     """
-    Incorporate the class/grade (branch_name) into the prompt so the content
-    is pitched at the student's level.
+    Prompt for a learning path on one weak concept, pitched at the student's
+    class/grade (branch_name).
     """
-    branch_name = st.session_state.auth_data.get('BranchName', 'their class')
-    prompt = (
+    return (
     f"You are a highly experienced educational AI assistant specializing in the NCERT curriculum. "
     f"A student in {branch_name} is struggling with the weak concept: '{concept_text}'. "
     f"Please create a structured, step-by-step learning path tailored to {branch_name} students, ensuring clarity, engagement, and curriculum alignment. "
@@ -458,88 +712,191 @@ def generate_learning_path(concept_text):
     f"Your goal is to provide a clear, engaging, and age-appropriate roadmap that helps the student gain confidence and proficiency in '{concept_text}'."
     )
 
+def _learning_path_reply(concept_text, branch_name):
+    """
+    The one learning-path completion call, shared by the single and the
+    concurrent paths so both use the same prompt, model and cache entries.
+    """
+    return _cached_chat(
+        CONTENT_MODEL,
+        (("system", learning_path_prompt(concept_text, branch_name)),),
+        1500,
+        temperature=0.3  # steadier structure for the PDF and the cache
+    )
+
+def generate_learning_path(concept_text):
+    """
+    Incorporate the class/grade (branch_name) into the prompt so the content
+    is pitched at the student's level.
+    """
+    branch_name = st.session_state.auth_data.get('BranchName', 'their class')
     try:
-        gpt_response = openai.ChatCompletion.create(
-            model="gpt-4o",  # or whichever GPT model you have access to
-            messages=[{"role": "system", "content": prompt}],
-            max_tokens=1500
-        ).choices[0].message['content'].strip()
-        return gpt_response
+        return _learning_path_reply(concept_text, branch_name)
     except Exception as e:
         st.error(f"Error generating learning path: {e}")
         return None
 
+def generate_learning_paths(concept_texts):
+    """
+    Generate learning paths for several concepts concurrently.
+    Returns a dict of concept_text -> learning path (None if the call failed).
+    """
+    # Read session state here: worker threads have no Streamlit script context
+    branch_name = st.session_state.auth_data.get('BranchName', 'their class')
+
+    def generate(concept_text):
+        try:
+            return _learning_path_reply(concept_text, branch_name)
+        except Exception as e:
+            print(f"Error generating learning path: {e}")
+            return None
+
+    if not concept_texts:
+        return {}
+    with script_thread_pool(min(8, len(concept_texts))) as executor:
+        return dict(zip(concept_texts, executor.map(generate, concept_texts)))
+
 
 # ================= LEARNING PATH DISPLAY FUNCTION =================
-def display_learning_path_with_resources(concept_text, learning_path, concept_list, topic_id):
+def learning_path_toggle_key(concept_text):
+    return f"show_learning_path_{concept_text}"
+
+def display_learning_path_with_resources(concept_text, learning_path, topic_id):
     """
     Display the generated learning path with enhanced formatting and resources for a single concept.
     """
     branch_name = st.session_state.auth_data.get('BranchName', 'their class')
-    with st.expander(f"📚 Learning Path for {concept_text} according to your learning gaps for {branch_name}", expanded=False):
+    # A toggle rather than an expander: Streamlit runs a collapsed expander's
+    # body anyway, while a switched-off toggle skips the resources and PDF work
+    if not st.toggle(
+        f"📚 Learning Path for {concept_text} according to your learning gaps for {branch_name}",
+        key=learning_path_toggle_key(concept_text)
+    ):
+        return
+    with st.container(border=True):
         # Display the learning path
         st.markdown(learning_path, unsafe_allow_html=True)
         
         # Attempt to fetch and display matching resources
-        resources = get_matching_resources(concept_text, concept_list, topic_id)
+        resources = get_matching_resources(concept_text, topic_id)
         if resources:
-            st.markdown("### 📌 Additional Learning Resources")
-            
-            # Display videos
-            if resources.get("Video_List"):
-                st.markdown("#### 🎥 Video Lectures")
-                for video in resources["Video_List"]:
-                    video_url = f"https://www.edubull.com/courses/videos/{video.get('LectureID', '')}"
-                    st.markdown(f"- [{video.get('LectureTitle', 'Video Lecture')}]({video_url})")
-            
-            # Display notes
-            if resources.get("Notes_List"):
-                st.markdown("#### 📄 Study Notes")
-                for note in resources["Notes_List"]:
-                    note_url = f"{note.get('FolderName', '')}{note.get('PDFFileName', '')}"
-                    st.markdown(f"- [{note.get('NotesTitle', 'Study Notes')}]({note_url})")
-            
-            # Display exercises
-            if resources.get("Exercise_List"):
-                st.markdown("#### 📝 Practice Exercises")
-                for exercise in resources["Exercise_List"]:
-                    exercise_url = f"{exercise.get('FolderName', '')}{exercise.get('ExerciseFileName', '')}"
-                    st.markdown(f"- [{exercise.get('ExerciseTitle', 'Practice Exercise')}]({exercise_url})")
+            # All lists go out as one markdown element rather than one per link
+            sections = ["### 📌 Additional Learning Resources"]
+            for heading, items in (
+                ("#### 🎥 Video Lectures", resources.videos),
+                ("#### 📄 Study Notes", resources.notes),
+                ("#### 📝 Practice Exercises", resources.exercises),
+            ):
+                if items:
+                    sections.append(heading + "\n" + "\n".join(f"- [{item.title}]({item.url})" for item in items))
+            st.markdown("\n\n".join(sections))
 
         # Download Button for the learning path
-        pdf_bytes = generate_learning_path_pdf(
+        user_name = st.session_state.auth_data['UserInfo'][0]['FullName']
+        pdf_download_button(
+            f"learning_path_{concept_text}",
             learning_path,
-            concept_text,
-            st.session_state.auth_data['UserInfo'][0]['FullName']
-        )
-        st.download_button(
-            label="📥 Download Learning Path as PDF",
-            data=pdf_bytes,
-            file_name=f"{st.session_state.auth_data['UserInfo'][0]['FullName']}_Learning_Path_{concept_text}.pdf",
-            mime="application/pdf"
+            "📥 Download Learning Path as PDF",
+            f"{user_name}_Learning_Path_{concept_text}.pdf",
+            lambda: generate_learning_path_pdf(learning_path, concept_text, user_name)
         )
 
 
-# ================= RESOURCES DISPLAY FUNCTION =================
-def display_resources(content_data):
-    branch_name = st.session_state.auth_data.get('BranchName', 'their class')
-    with st.expander("📚 Resources", expanded=True):
-        concept_description = st.session_state.get("generated_description", "No description available.")
-        st.markdown(f"### Concept Description for {branch_name}\n{concept_description}\n")
-        if content_data.get("Video_List"):
-            for video in content_data["Video_List"]:
-                video_url = video.get("LectureLink", f"https://www.edubull.com/courses/videos/{video.get('LectureID', '')}")
-                st.write(f"- [Video 🎥]({video_url})")
-        if content_data.get("Notes_List"):
-            for note in content_data["Notes_List"]:
-                note_url = f"{note.get('FolderName', '')}{note.get('PDFFileName', '')}"
-                st.write(f"- [Notes 📄]({note_url})")
-        if content_data.get("Exercise_List"):
-            for exercise in content_data["Exercise_List"]:
-                exercise_url = f"{exercise.get('FolderName', '')}{exercise.get('ExerciseFileName', '')}"
-                st.write(f"- [Exercise 📝]({exercise_url})")
-
 # ================= TEACHER DASHBOARD FUNCTIONS =================
+# Vega-Lite specs for the teacher charts. Data is passed in per render, so
+# no Altair chart objects have to be built and serialized on each rerun.
+WEAK_CONCEPTS_BAR_SPEC = {
+    "title": "Weak Concepts Overview",
+    "width": 600,
+    "layer": [
+        {
+            "data": {"name": "table"},
+            "mark": "bar",
+            "params": [{"name": "zoom", "select": "interval", "bind": "scales"}],
+            "encoding": {
+                "x": {"field": "Concept", "type": "nominal"},
+                "y": {"field": "Count", "type": "quantitative"},
+                "color": {"field": "Category", "type": "nominal"},
+                # Concept and category are already on the axis and in the legend
+                "tooltip": {"field": "Count", "type": "quantitative"}
+            }
+        },
+        # Red rule for total students
+        {
+            "data": {"name": "total"},
+            "mark": {"type": "rule", "color": "red", "strokeDash": [4, 4]},
+            "encoding": {"y": {"field": "y", "type": "quantitative"}}
+        },
+        # Label for the rule
+        {
+            "data": {"name": "total"},
+            "mark": {"type": "text", "align": "left", "dx": 5, "dy": -5, "color": "red"},
+            "encoding": {
+                "y": {"field": "y", "type": "quantitative"},
+                "text": {"field": "label", "type": "nominal"}
+            }
+        }
+    ]
+}
+
+# The static charts below use the SVG renderer, which repaints only changed
+# marks; the zoomable overview above keeps the default canvas renderer
+_SVG_EMBED = {"embedOptions": {"renderer": "svg"}}
+
+DONUT_SPEC = {
+    "title": "Overall Cleared vs Not Cleared Students",
+    "usermeta": _SVG_EMBED,
+    "mark": {"type": "arc", "innerRadius": 50},
+    "encoding": {
+        "theta": {"field": "Count", "type": "quantitative"},
+        "color": {"field": "Category", "type": "nominal", "legend": {"title": "Category"}},
+        "tooltip": {"field": "Count", "type": "quantitative"}
+    }
+}
+
+HBAR_SPEC = {
+    "title": "Attended vs Cleared per Concept (Horizontal View)",
+    "usermeta": _SVG_EMBED,
+    "width": 600,
+    "mark": "bar",
+    "encoding": {
+        "x": {"field": "Count", "type": "quantitative"},
+        "y": {"field": "Concept", "type": "nominal", "sort": "-x", "title": "Concepts"},
+        "color": {"field": "Category", "type": "nominal", "legend": {"title": "Category"}},
+        "tooltip": {"field": "Count", "type": "quantitative"}
+    }
+}
+
+# Per-concept charts show at most this many concepts, weakest first
+_CHART_MAX_CONCEPTS = 30
+
+def _cleared_ratio(wc):
+    attended = wc["AttendedStudentCount"]
+    return wc["ClearedStudentCount"] / attended if attended else 1
+
+@st.cache_data(show_spinner=False)
+def weak_concept_chart_data(weak_concepts):
+    """
+    Chart data for a batch's weak concepts: long-form rows (one Attended and
+    one Cleared count per concept, for the weakest _CHART_MAX_CONCEPTS
+    concepts by cleared ratio) and the overall cleared/not-cleared split
+    across all concepts. Cached so reruns with the same batch skip the
+    aggregation.
+    """
+    charted = sorted(weak_concepts, key=_cleared_ratio)[:_CHART_MAX_CONCEPTS]
+    rows = [
+        {"Concept": wc["ConceptText"], "Category": category, "Count": wc[key]}
+        for wc in charted
+        for category, key in (("Attended", "AttendedStudentCount"), ("Cleared", "ClearedStudentCount"))
+    ]
+    total_attended = sum(wc["AttendedStudentCount"] for wc in weak_concepts)
+    total_cleared = sum(wc["ClearedStudentCount"] for wc in weak_concepts)
+    overall = [
+        {'Category': 'Cleared', 'Count': total_cleared},
+        {'Category': 'Not Cleared', 'Count': total_attended - total_cleared}
+    ]
+    return rows, overall
+
 def teacher_dashboard():
     batches = st.session_state.auth_data.get("BatchList", [])
     if not batches:
@@ -556,65 +913,47 @@ def teacher_dashboard():
         st.session_state.selected_batch_id = selected_batch_id
         user_info = st.session_state.auth_data.get('UserInfo', [{}])[0]
         org_code = user_info.get('OrgCode', '012')
-        params = {
-            "BatchID": selected_batch_id,
-            "TopicID": st.session_state.topic_id,
-            "OrgCode": org_code
-        }
-        headers = {
-            "Content-Type": "application/json",
-            "User-Agent": "Mozilla/5.0",
-            "Accept": "application/json"
-        }
         with st.spinner("🔄 Fetching weak concepts..."):
             try:
-                response = requests.post(API_TEACHER_WEAK_CONCEPTS, json=params, headers=headers)
-                response.raise_for_status()
-                weak_concepts = response.json()
-                st.session_state.teacher_weak_concepts = weak_concepts
+                st.session_state.teacher_weak_concepts = fetch_weak_concepts(
+                    selected_batch_id, st.session_state.topic_id, org_code
+                )
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+                st.error("⏳ Weak concepts could not be loaded right now. Please try again in a moment.")
+                st.session_state.teacher_weak_concepts = []
             except Exception as e:
                 st.error(f"Error fetching weak concepts: {e}")
                 st.session_state.teacher_weak_concepts = []
+        st.session_state.teacher_concept_map = {
+            wc["ConceptText"]: wc["ConceptID"] for wc in st.session_state.teacher_weak_concepts
+        }
 
     if st.session_state.teacher_weak_concepts:
-        df = []
-        for wc in st.session_state.teacher_weak_concepts:
-            df.append({
-                "Concept": wc["ConceptText"],
-                "Attended": wc["AttendedStudentCount"],
-                "Cleared": wc["ClearedStudentCount"]
-            })
-        df = pd.DataFrame(df)
-
-        # Create an Altair chart
-        df_long = df.melt('Concept', var_name='Category', value_name='Count')
-        chart = alt.Chart(df_long).mark_bar().encode(
-            x='Concept:N',
-            y='Count:Q',
-            color='Category:N',
-            tooltip=['Concept:N', 'Category:N', 'Count:Q']
-        ).properties(
-            title='Weak Concepts Overview',
-            width=600
+        rows, overall = weak_concept_chart_data(st.session_state.teacher_weak_concepts)
+        concept_count = len(st.session_state.teacher_weak_concepts)
+        if concept_count > _CHART_MAX_CONCEPTS:
+            st.caption(f"Charts show the {_CHART_MAX_CONCEPTS} weakest of {concept_count} concepts.")
+
+        st.vega_lite_chart(
+            spec=dict(WEAK_CONCEPTS_BAR_SPEC, datasets={
+                "table": rows,
+                "total": [{"y": total_students, "label": f"Total Students: {total_students}"}]
+            }),
+            use_container_width=True
         )
 
-        # Red rule for total students
-        rule = alt.Chart(pd.DataFrame({'y': [total_students]})).mark_rule(color='red', strokeDash=[4, 4]).encode(
-            y='y:Q'
-        )
-        # Label for the rule
-        text = alt.Chart(pd.DataFrame({'y': [total_students]})).mark_text(
-            align='left', dx=5, dy=-5, color='red'
-        ).encode(
-            y='y:Q',
-            text=alt.value(f'Total Students: {total_students}')
-        )
+        display_additional_graphs(rows, overall)
 
-        final_chart = (chart + rule + text).interactive()
-        st.altair_chart(final_chart, use_container_width=True)
-
-        display_additional_graphs(st.session_state.teacher_weak_concepts)
+    exam_questions_panel(st.session_state.teacher_concept_map)
 
+@st.fragment
+def exam_questions_panel(concept_map):
+    """
+    Bloom level and concept pickers, exam question generation and the PDF
+    download. Runs as a fragment, so interacting with it does not rebuild
+    the batch charts above.
+    """
+    if concept_map:
         bloom_level = st.radio(
             "Select Bloom's Taxonomy Level for the Questions",
             [
@@ -627,11 +966,10 @@ def teacher_dashboard():
             index=3  # Default to L4
         )
 
-        concept_list = {wc["ConceptText"]: wc["ConceptID"] for wc in st.session_state.teacher_weak_concepts}
-        chosen_concept_text = st.radio("Select a Concept to Generate Exam Questions:", list(concept_list.keys()))
+        chosen_concept_text = st.radio("Select a Concept to Generate Exam Questions:", list(concept_map.keys()))
 
         if chosen_concept_text:
-            chosen_concept_id = concept_list[chosen_concept_text]
+            chosen_concept_id = concept_map[chosen_concept_text]
             st.session_state.selected_teacher_concept_id = chosen_concept_id
             st.session_state.selected_teacher_concept_text = chosen_concept_text
 
@@ -641,158 +979,194 @@ def teacher_dashboard():
                 # Parse out the short code (L1, L2, etc.) from the selectbox choice
                 bloom_short = bloom_level.split()[0]  # E.g., "L4"
 
-                # Build the prompt
-                prompt = (
-                    f"You are an educational AI assistant helping a teacher. The teacher wants to create "
-                    f"exam questions for the concept '{chosen_concept_text}'.\n"
-                    f"The teacher is teaching students in {branch_name}, following the NCERT curriculum.\n"
-                    f"Generate a set of 20 challenging and thought-provoking exam questions related to this concept.\n"
-                    f"Generated questions should be aligned with NEP 2020 and NCF guidelines.\n"
-                    f"Vary in difficulty.\n"
-                    f"Encourage critical thinking.\n"
-                    f"Be clearly formatted and numbered.\n\n"
-                    f"Do not provide the answers, only the questions.\n"
-                    f"Ensure that all mathematical expressions are enclosed within LaTeX delimiters (`$...$` for inline "
-                    f"and `$$...$$` for display).\n"
-                    f"Focus on **Bloom's Taxonomy Level {bloom_short}**.\n"
-                    f"Label each question clearly with **({bloom_short})** at the end of the question.\n"
+                # Only the concept, class and Bloom level change between requests
+                user_message = (
+                    f"Concept: {chosen_concept_text}\n"
+                    f"Class: {branch_name}\n"
+                    f"Bloom's Taxonomy Level: {bloom_short}\n"
+                    f"Generate 20 questions, each labelled **({bloom_short})**."
                 )
 
-                with st.spinner("Generating exam questions... Please wait."):
-                    try:
-                        response = openai.ChatCompletion.create(
-                            model="gpt-4o",  # or whichever GPT model you have access to
-                            messages=[{"role": "system", "content": prompt}],
-                            max_tokens=5000
-                        )
-                        questions = response.choices[0].message['content'].strip()
-                        st.session_state.exam_questions = questions
-                    except Exception as e:
-                        st.error(f"Error generating exam questions: {e}")
+                try:
+                    response = stream_completion(
+                        "Generating exam questions... Please wait.",
+                        model=CONTENT_MODEL,
+                        messages=[
+                            {"role": "system", "content": EXAM_QUESTIONS_SYSTEM_PROMPT},
+                            {"role": "user", "content": user_message}
+                        ],
+                        max_tokens=5000
+                    )
+                    # Show the questions as they are generated
+                    placeholder = st.empty()
+                    questions = ""
+                    for chunk in response:
+                        questions += chunk['choices'][0]['delta'].get('content', '')
+                        placeholder.markdown(questions)
+                    placeholder.empty()
+                    st.session_state.exam_questions = questions.strip()
+                except Exception as e:
+                    st.error(f"Error generating exam questions: {e}")
 
     if st.session_state.exam_questions:
         branch_name = st.session_state.auth_data.get("BranchName", "their class")
         st.markdown(f"### 📝 Generated Exam Questions for {branch_name}")
         st.markdown(st.session_state.exam_questions)
 
-        pdf_bytes = generate_exam_questions_pdf(
+        concept_text = st.session_state.selected_teacher_concept_text
+        pdf_download_button(
+            "exam_questions",
             st.session_state.exam_questions,
-            st.session_state.selected_teacher_concept_text,
-            st.session_state.auth_data['UserInfo'][0]['FullName']
-        )
-        st.download_button(
-            label="📥 Download Exam Questions as PDF",
-            data=pdf_bytes,
-            file_name=f"Exam_Questions_{st.session_state.selected_teacher_concept_text}.pdf",
-            mime="application/pdf"
+            "📥 Download Exam Questions as PDF",
+            f"Exam_Questions_{concept_text}.pdf",
+            lambda: generate_exam_questions_pdf(
+                st.session_state.exam_questions,
+                concept_text,
+                st.session_state.auth_data['UserInfo'][0]['FullName']
+            )
         )
 
-def display_additional_graphs(weak_concepts):
-    df = pd.DataFrame(weak_concepts)
-    total_attended = df["AttendedStudentCount"].sum()
-    total_cleared = df["ClearedStudentCount"].sum()
-    total_not_cleared = total_attended - total_cleared
-
+def display_additional_graphs(rows, overall):
     # Donut chart
-    data_overall = pd.DataFrame({
-        'Category': ['Cleared', 'Not Cleared'],
-        'Count': [total_cleared, total_not_cleared]
-    })
-    donut_chart = alt.Chart(data_overall).mark_arc(innerRadius=50).encode(
-        theta='Count:Q',
-        color=alt.Color('Category:N', legend=alt.Legend(title="Category")),
-        tooltip=['Category:N', 'Count:Q']
-    ).properties(
-        title='Overall Cleared vs Not Cleared Students'
-    )
-    st.altair_chart(donut_chart, use_container_width=True)
-
-    # Horizontal bar chart
-    df_long = df.melt(
-        id_vars='ConceptText',
-        value_vars=['AttendedStudentCount', 'ClearedStudentCount'],
-        var_name='Category',
-        value_name='Count'
-    )
-    df_long['Category'] = df_long['Category'].replace({
-        'AttendedStudentCount': 'Attended',
-        'ClearedStudentCount': 'Cleared'
-    })
-    horizontal_bar = alt.Chart(df_long).mark_bar().encode(
-        x=alt.X('Count:Q'),
-        y=alt.Y('ConceptText:N', sort='-x', title='Concepts'),
-        color=alt.Color('Category:N', legend=alt.Legend(title="Category")),
-        tooltip=['ConceptText:N', 'Category:N', 'Count:Q']
-    ).properties(
-        title='Attended vs Cleared per Concept (Horizontal View)',
-        width=600
-    )
-    st.altair_chart(horizontal_bar, use_container_width=True)
+    st.vega_lite_chart(overall, DONUT_SPEC, use_container_width=True)
+
+    # Horizontal bar chart, from the same long-form rows as the overview
+    st.vega_lite_chart(rows, HBAR_SPEC, use_container_width=True)
 
 # ================= LOGIN SCREEN FUNCTION =================
-def login_screen():
-    try:
-        image_url = "https://raw.githubusercontent.com/EdubullTechnologies/QR-ChatBot/master/Desktop/app-final-qrcode/assets/login_page_img.png"
-        col1, col2 = st.columns([1, 2])
-        with col1:
-            st.image(image_url, width=160)
-        st.markdown("""<style>
+# Static login page markup, built once at import
+LOGIN_IMAGE_URL = "https://raw.githubusercontent.com/EdubullTechnologies/QR-ChatBot/master/Desktop/app-final-qrcode/assets/login_page_img.png"
+ICON_IMAGE_URL = "https://raw.githubusercontent.com/EdubullTechnologies/QR-ChatBot/master/Desktop/app-final-qrcode/assets/icon.png"
+_LOGIN_CSS = """<style>
         @media only screen and (max-width: 600px) {
             .title { font-size: 2.5em; margin-top: 20px; text-align: center; }
         }
         @media only screen and (min-width: 601px) {
             .title { font-size: 4em; font-weight: bold; margin-top: 90px; margin-left: -125px; text-align: left; }
         }
-        </style>""", unsafe_allow_html=True)
-        with col2:
-            st.markdown('<div class="title">EeeBee AI Buddy Login</div>', unsafe_allow_html=True)
-    except Exception as e:
-        st.error(f"Error loading image: {e}")
-
-    st.markdown('<h3 style="font-size: 1.5em;">🦾 Welcome! Please enter your credentials to chat with your AI Buddy!</h3>', unsafe_allow_html=True)
-
-    user_type = st.radio("Select User Type", ["Student", "Teacher"])
-    user_type_value = 2 if user_type == "Teacher" else None  # Set to None for students
+        </style>"""
+_LOGIN_TITLE_HTML = '<div class="title">EeeBee AI Buddy Login</div>'
+_LOGIN_WELCOME_HTML = '<h3 style="font-size: 1.5em;">🦾 Welcome! Please enter your credentials to chat with your AI Buddy!</h3>'
 
-    org_code = st.text_input("🏫 School Code", key="org_code")
-    login_id = st.text_input("👤 Login ID", key="login_id")
-    password = st.text_input("🔒 Password", type="password", key="password")
+# Images bundled next to app.py; the GitHub URLs above are only a fallback
+ASSETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets")
 
-    query_params = st.experimental_get_query_params()
-    E_params = query_params.get("E", [None])
-    T_params = query_params.get("T", [None])
+@st.cache_resource(show_spinner=False)
+def load_asset(filename):
+    """
+    Read a bundled image once per server process; reruns reuse the bytes.
+    A missing file raises, so nothing is cached.
+    """
+    with open(os.path.join(ASSETS_DIR, filename), "rb") as f:
+        return f.read()
+
+@st.cache_resource(show_spinner=False)
+def _icon_data_uri():
+    # The icon is shown 55px wide; a 110px copy keeps it sharp on high-DPI
+    # screens and keeps the data: URI small, since it is re-sent with the header
+    from PIL import Image
+
+    img = Image.open(BytesIO(load_asset("icon.png")))
+    img.thumbnail((110, 110))
+    buf = BytesIO()
+    img.save(buf, format="PNG", optimize=True)
+    return "data:image/png;base64," + base64.b64encode(buf.getvalue()).decode()
+
+def icon_src():
+    """
+    The header icon as a data: URI from the bundled asset, so neither the
+    server nor the browser fetches it on a rerun. Falls back to the remote
+    URL if the asset is missing or unreadable.
+    """
+    try:
+        return _icon_data_uri()
+    except OSError as e:
+        print(f"Error loading icon: {e}")
+        return ICON_IMAGE_URL
 
-    E_value = E_params[0]
-    T_value = T_params[0]
+def authenticate(api_url, auth_payload):
+    """
+    Post the login credentials and return the decoded auth response.
+    """
+    auth_response = get_http_session().post(api_url, json=auth_payload, timeout=_API_TIMEOUT)
+    auth_response.raise_for_status()
+    return orjson.loads(auth_response.content)
 
-    api_url = None
-    topic_id = None
+@st.cache_data(persist="disk", show_spinner=False)
+def _dev_cached_authenticate(api_url, payload_items):
+    """
+    Disk-persisted authenticate() for local development, so restarting the
+    app does not log in against the API again. Only used when DEV_AUTH_CACHE
+    is set; clear it with `streamlit cache clear`.
+    """
+    return authenticate(api_url, dict(payload_items))
 
-    # Determine mode based on E and T
+def parse_topic_params(E_value, T_value):
+    """
+    Work out the auth endpoint and topic from the E (English) or T
+    (Non-English) query parameter.
+    Returns (api_url, topic_id, is_english_mode, warning); warning is set
+    and the rest are None when the parameters are not usable.
+    """
     if E_value is not None and T_value is not None:
-        st.warning("Please provide either E for English OR T for Non-English, not both.")
-    elif E_value is not None and T_value is None:
+        return None, None, None, "Please provide either E for English OR T for Non-English, not both."
+    if E_value is None and T_value is None:
+        return None, None, None, "Please provide E for English mode or T for Non-English mode."
+    if E_value is not None:
         # English mode
-        st.session_state.is_english_mode = True
-        api_url = API_AUTH_URL_ENGLISH
-        topic_id = E_value
-    elif E_value is None and T_value is not None:
+        api_url, raw_topic_id, is_english_mode = API_AUTH_URL_ENGLISH, E_value, True
+    else:
         # Non-English mode
-        st.session_state.is_english_mode = False
-        api_url = API_AUTH_URL_MATH_SCIENCE
-        topic_id = T_value
+        api_url, raw_topic_id, is_english_mode = API_AUTH_URL_MATH_SCIENCE, T_value, False
+    try:
+        return api_url, int(raw_topic_id), is_english_mode, None
+    except ValueError:
+        return None, None, None, "Please ensure correct E or T parameter is provided."
+
+def login_screen():
+    try:
+        col1, col2 = st.columns([1, 2])
+        with col1:
+            # Its own try, so a missing image never costs the page its CSS and title
+            try:
+                st.image(load_asset("login_page_img.png"), width=160)
+            except OSError as e:
+                print(f"Error loading login image: {e}")
+                st.image(LOGIN_IMAGE_URL, width=160)
+        st.markdown(_LOGIN_CSS, unsafe_allow_html=True)
+        with col2:
+            st.markdown(_LOGIN_TITLE_HTML, unsafe_allow_html=True)
+    except Exception as e:
+        st.error(f"Error loading image: {e}")
+
+    st.markdown(_LOGIN_WELCOME_HTML, unsafe_allow_html=True)
+
+    # Typing into the form does not rerun the script; only submitting does
+    with st.form("login_form"):
+        user_type = st.radio("Select User Type", ["Student", "Teacher"])
+        org_code = st.text_input("🏫 School Code", key="org_code")
+        login_id = st.text_input("👤 Login ID", key="login_id")
+        password = st.text_input("🔒 Password", type="password", key="password")
+        submitted = st.form_submit_button("🚀 Login and Start Chatting!")
+    user_type_value = 2 if user_type == "Teacher" else None  # Set to None for students
+
+    # The query parameters are fixed for the session, so parse them only once
+    if "topic_params" not in st.session_state:
+        st.session_state.topic_params = parse_topic_params(st.query_params.get("E"), st.query_params.get("T"))
+    api_url, topic_id, is_english_mode, topic_warning = st.session_state.topic_params
+    if topic_warning:
+        st.warning(topic_warning)
     else:
-        # Neither E nor T provided
-        st.warning("Please provide E for English mode or T for Non-English mode.")
+        st.session_state.is_english_mode = is_english_mode
 
-    if st.button("🚀 Login and Start Chatting!") and not st.session_state.is_authenticated:
+    if submitted and not st.session_state.is_authenticated:
         if topic_id is None or api_url is None:
             st.warning("Please ensure correct E or T parameter is provided.")
             return
 
         auth_payload = {
             'OrgCode': org_code,
-            'TopicID': int(topic_id),
+            'TopicID': topic_id,
             'LoginID': login_id,
             'Password': password,
         }
@@ -800,135 +1174,102 @@ def login_screen():
         if user_type_value:
             auth_payload['UserType'] = user_type_value  # Only add if user is Teacher
 
-        headers = {
-            "Content-Type": "application/json",
-            "User-Agent": "Mozilla/5.0",
-            "Accept": "application/json"
-        }
         try:
             with st.spinner("🔄 Authenticating..."):
-                auth_response = requests.post(api_url, json=auth_payload, headers=headers)
-                auth_response.raise_for_status()
-                auth_data = auth_response.json()
+                if os.getenv("DEV_AUTH_CACHE"):
+                    auth_data = _dev_cached_authenticate(api_url, tuple(sorted(auth_payload.items())))
+                else:
+                    auth_data = authenticate(api_url, auth_payload)
                 if auth_data.get("statusCode") == 1:
                     st.session_state.auth_data = auth_data
                     st.session_state.is_authenticated = True
-                    st.session_state.topic_id = int(topic_id)
+                    st.session_state.topic_id = topic_id
                     st.session_state.is_teacher = (user_type_value == 2)
+                    index_concepts(auth_data.get("ConceptList", []))
+                    st.session_state.initial_greeting = build_greeting(auth_data)
                     # If student, populate weak concepts
                     if not st.session_state.is_teacher:
                         st.session_state.student_weak_concepts = auth_data.get("WeakConceptList", [])
-                    st.rerun()
+                        # Fetch resources for every weak concept concurrently, up front
+                        st.session_state.concept_resources = fetch_resources_batch(topic_id, [
+                            c['ConceptID'] for c in st.session_state.student_weak_concepts
+                        ])
+                    return True
                 else:
                     st.error("🚫 Authentication failed. Please check your credentials.")
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+            st.error("⏳ The login service is not responding right now. Please try again in a moment.")
         except requests.exceptions.RequestException as e:
             st.error(f"Error connecting to the authentication API: {e}")
             
-# ================= LOAD CONCEPT CONTENT FUNCTION =================
-def load_concept_content():
-    selected_concept_id = st.session_state.selected_concept_id
-    selected_concept_name = next(
-        (concept['ConceptText'] for concept in st.session_state.auth_data['ConceptList'] if concept['ConceptID'] == selected_concept_id),
-        "Unknown Concept"
+# ================= CHAT-RELATED FUNCTIONS =================
+def build_greeting(auth_data):
+    """
+    Build the opening chat message listing the topic's concepts and the
+    student's learning gaps. Computed once at login.
+    """
+    user_name = auth_data['UserInfo'][0]['FullName']
+    topic_name = auth_data['TopicName']
+    
+    # Get concepts and weak concepts
+    concept_list = auth_data.get('ConceptList', [])
+    weak_concepts = auth_data.get('WeakConceptList', [])
+    
+    # Create concept options markdown
+    concept_options = "\n\n**📚 Available Concepts:**\n" + "".join(
+        f"- {concept['ConceptText']}\n" for concept in concept_list
     )
-
-    # We'll also pass the student's class/grade level (branch_name) to the prompt
-    branch_name = st.session_state.auth_data.get('BranchName', 'their class')
-    prompt = (
-        f"The student is in {branch_name}. Provide a concise and educational description of the concept "
-        f"'{selected_concept_name}', pitched at the level of {branch_name} students, to help them understand it better. "
-        f"Ensure that all mathematical expressions are enclosed within LaTeX delimiters (`$...$` for inline and `$$...$$` for display)."
+        
+    # Create weak concepts markdown if any exist
+    weak_concepts_text = ""
+    if weak_concepts:
+        weak_concepts_text = "\n\n**🎯 Your Current Learning Gaps:**\n" + "".join(
+            f"- {concept['ConceptText']}\n" for concept in weak_concepts
+        )
+    
+    return (
+        f"Hello {user_name}! I'm your 🤖 EeeBee AI buddy. "
+        f"I'm here to help you with {topic_name}.\n\n"
+        f"You can:\n"
+        f"1. Ask me questions about any concept\n"
+        f"2. Request learning resources (videos, notes, exercises)\n"
+        f"3. Get help understanding specific topics\n"
+        f"{concept_options}"
+        f"{weak_concepts_text}\n\n"
+        f"What would you like to discuss?"
     )
 
-    content_payload = {
-        'TopicID': st.session_state.topic_id,
-        'ConceptID': int(selected_concept_id)
-    }
-    headers = {
-        "Content-Type": "application/json",
-        "User-Agent": "Mozilla/5.0",
-        "Accept": "application/json"
-    }
-    try:
-        with st.spinner("🔄 Fetching concept content..."):
-            content_response = requests.post(API_CONTENT_URL, json=content_payload, headers=headers)
-            content_response.raise_for_status()
-            content_data = content_response.json()
-
-            # Generate concept description from GPT
-            gpt_response = openai.ChatCompletion.create(
-                model="gpt-4o-mini",  # or whichever GPT model
-                messages=[{"role": "system", "content": prompt}],
-                max_tokens=500
-            ).choices[0].message['content'].strip()
-
-            # Minor replacements if needed
-            gpt_response = gpt_response.replace("This concept", selected_concept_name).replace("this concept", selected_concept_name)
-            gpt_response += "\n\nYou can check the resources below for more information."
-            st.session_state.generated_description = gpt_response
-
-            display_resources(content_data)
-
-    except requests.exceptions.RequestException as req_err:
-        st.error(f"Error fetching content: {req_err}")
-    except Exception as e:
-        st.error(f"Error generating concept description: {e}")
-
-# ================= CHAT-RELATED FUNCTIONS =================
 def add_initial_greeting():
-    if len(st.session_state.chat_history) == 0 and st.session_state.auth_data:
-        user_name = st.session_state.auth_data['UserInfo'][0]['FullName']
-        topic_name = st.session_state.auth_data['TopicName']
-        
-        # Get concepts and weak concepts
-        concept_list = st.session_state.auth_data.get('ConceptList', [])
-        weak_concepts = st.session_state.auth_data.get('WeakConceptList', [])
-        
-        # Create concept options markdown
-        concept_options = "\n\n**📚 Available Concepts:**\n"
-        for concept in concept_list:
-            concept_options += f"- {concept['ConceptText']}\n"
-            
-        # Create weak concepts markdown if any exist
-        weak_concepts_text = ""
-        if weak_concepts:
-            weak_concepts_text = "\n\n**🎯 Your Current Learning Gaps:**\n"
-            for concept in weak_concepts:
-                weak_concepts_text += f"- {concept['ConceptText']}\n"
-        
-        # Store concepts in session state for later use
-        st.session_state.available_concepts = {
-            concept['ConceptText']: concept['ConceptID'] 
-            for concept in concept_list
-        }
-        
-        greeting_message = (
-            f"Hello {user_name}! I'm your 🤖 EeeBee AI buddy. "
-            f"I'm here to help you with {topic_name}.\n\n"
-            f"You can:\n"
-            f"1. Ask me questions about any concept\n"
-            f"2. Request learning resources (videos, notes, exercises)\n"
-            f"3. Get help understanding specific topics\n"
-            f"{concept_options}"
-            f"{weak_concepts_text}\n\n"
-            f"What would you like to discuss?"
-        )
-        
-        st.session_state.chat_history.append(("assistant", greeting_message))
+    if not st.session_state.chat_history and st.session_state.initial_greeting:
+        st.session_state.chat_history.append(("assistant", st.session_state.initial_greeting))
 
 
-def handle_user_input(user_input):
+def on_chat_submit():
+    """
+    chat_input callback: record the question before the script reruns, so the
+    history box already shows it and handle_user_input can answer it.
+    """
+    user_input = st.session_state.chat_in
     if user_input:
         st.session_state.chat_history.append(("user", user_input))
-        get_gpt_response(user_input)
-        st.rerun()
+        st.session_state.pending_user_input = user_input
 
 
-def get_system_prompt():
-    topic_name = st.session_state.auth_data.get('TopicName', 'Unknown Topic')
-    branch_name = st.session_state.auth_data.get('BranchName', 'their class')
+def handle_user_input():
+    user_input = st.session_state.pending_user_input
+    if user_input:
+        st.session_state.pending_user_input = None
+        # The reply is streamed in place, so no extra rerun is needed to show it
+        get_gpt_response(user_input)
 
-    if st.session_state.is_teacher:
+
+@st.cache_data(show_spinner=False)
+def _build_system_prompt(is_teacher, topic_name, branch_name, weak_concepts):
+    """
+    Render the system prompt for the given user settings. It only depends on
+    these few values, so it is built once and reused for every chat turn.
+    """
+    if is_teacher:
         # TEACHER MODE PROMPT
         system_prompt = f"""
 You are a highly knowledgeable educational assistant named EeeBee, built by iEdubull, and specialized in {topic_name}.
@@ -948,7 +1289,6 @@ Teacher Mode Instructions:
         """
     else:
         # STUDENT MODE PROMPT
-        weak_concepts = [concept['ConceptText'] for concept in st.session_state.student_weak_concepts]
         weak_concepts_text = ", ".join(weak_concepts) if weak_concepts else "none"
 
         system_prompt = f"""
@@ -974,53 +1314,90 @@ Student Mode Instructions:
     return system_prompt
 
 
+def get_system_prompt():
+    topic_name = st.session_state.auth_data.get('TopicName', 'Unknown Topic')
+    branch_name = st.session_state.auth_data.get('BranchName', 'their class')
+    weak_concepts = tuple(concept['ConceptText'] for concept in st.session_state.student_weak_concepts)
+    return _build_system_prompt(st.session_state.is_teacher, topic_name, branch_name, weak_concepts)
+
+
 def get_gpt_response(user_input):
     """
     Enhanced GPT response function that can handle resource requests and concept discussions
     """
     system_prompt = get_system_prompt()
-    conversation_history_formatted = [{"role": "system", "content": system_prompt}]
-    conversation_history_formatted += [
-        {"role": role, "content": content}
-        for role, content in st.session_state.chat_history
-    ]
+    # Only recent turns are sent, which bounds prompt size and cost in long chats
+    conversation_history_formatted = (("system", system_prompt),) + tuple(
+        st.session_state.chat_history[-_CHAT_HISTORY_MESSAGES:]
+    )
     
     try:
-        with st.spinner("EeeBee is thinking..."):
-            # Check if user is asking about a specific concept
-            concept_list = st.session_state.auth_data.get('ConceptList', [])
-            mentioned_concept = None
-            
-            # Look for concept mentions in the user input
-            for concept in concept_list:
-                if concept['ConceptText'].lower() in user_input.lower():
-                    mentioned_concept = concept['ConceptText']
-                    break
-            
-            # Get GPT response
-            gpt_response = openai.ChatCompletion.create(
-                model="gpt-4o-mini",
-                messages=conversation_history_formatted,
+        # Look for a concept mentioned in the user input
+        concept_regex = st.session_state.concept_regex
+        match = concept_regex.search(user_input) if concept_regex else None
+        mentioned_concept = match.group(0) if match else None
+        
+        # If a concept was mentioned and the user seems to be asking about resources
+        resource_concept_id = None
+        if mentioned_concept and _RESOURCE_REQUEST_RE.search(user_input):
+            resource_concept_id = st.session_state.concept_ids_by_text.get(concept_key(mentioned_concept))
+
+        with script_thread_pool(1) as executor:
+            # Fetch the resources (unless prefetched) while the reply streams
+            resources_future = None
+            if resource_concept_id is not None and resource_concept_id not in st.session_state.concept_resources:
+                resources_future = executor.submit(
+                    fetch_resources_by_concept_id, st.session_state.topic_id, resource_concept_id
+                )
+
+            # Stream the GPT response so tokens show up as they arrive
+            response = stream_completion(
+                "EeeBee is thinking...",
+                model=CHAT_MODEL,
+                messages=[{"role": role, "content": content} for role, content in conversation_history_formatted],
                 max_tokens=2000
-            ).choices[0].message['content'].strip()
-            
-            st.session_state.chat_history.append(("assistant", gpt_response))
+            )
+            gpt_response = st.chat_message("assistant").write_stream(
+                chunk['choices'][0]['delta'].get('content', '') for chunk in response
+            )
+        gpt_response = gpt_response.strip()
+        
+        st.session_state.chat_history.append(("assistant", gpt_response))
+        
+        if resource_concept_id is not None:
+            if resources_future is not None and resources_future.exception() is not None:
+                print(f"Error fetching resources: {resources_future.exception()}")
+                resources = None
+            else:
+                # Served from the prefetch or the fetch cache filled above
+                resources = load_concept_resources(st.session_state.topic_id, resource_concept_id)
+            if resources:
+                resource_message = format_resources_message(resources)
+                st.session_state.chat_history.append(("assistant", resource_message))
+                st.chat_message("assistant").markdown(resource_message)
             
-            # If a concept was mentioned and the user seems to be asking about resources
-            if mentioned_concept and any(word in user_input.lower() 
-                                       for word in ['resource', 'material', 'video', 'note', 'exercise']):
-                resources = get_resources_for_concept(
-                    mentioned_concept,
-                    concept_list,
-                    st.session_state.topic_id
-                )
-                if resources:
-                    resource_message = format_resources_message(resources)
-                    st.session_state.chat_history.append(("assistant", resource_message))
-                
     except Exception as e:
         st.error(f"Error in GPT response generation: {e}")
 
+@st.fragment
+def display_chat():
+    """
+    Chat panel: greeting, history, input box and the reply to a new question.
+    Runs as a fragment, so sending a message does not rerun the rest of the
+    page (dashboard charts, learning paths).
+    """
+    st.subheader("Chat with your EeeBee AI buddy", anchor=None)
+    add_initial_greeting()
+    # Native chat elements in a fixed-height scrolling box; unchanged messages
+    # are diffed away by the frontend instead of re-sending one HTML blob
+    with st.container(height=400):
+        for role, message in st.session_state.chat_history:
+            with st.chat_message("assistant" if role == "assistant" else "user"):
+                st.markdown(message)
+        # A new reply streams in below the history, inside the same box
+        handle_user_input()
+    st.chat_input("Enter your question about the topic", key="chat_in", on_submit=on_chat_submit)
+
 # ================= MAIN SCREEN FUNCTION (POST-LOGIN) =================
 def main_screen():
     user_name = st.session_state.auth_data['UserInfo'][0]['FullName']
@@ -1032,7 +1409,7 @@ def main_screen():
             st.session_state.clear()
             st.rerun()
 
-    icon_img = "https://raw.githubusercontent.com/EdubullTechnologies/QR-ChatBot/master/Desktop/app-final-qrcode/assets/icon.png"
+    icon_img = icon_src()
     st.markdown(
         f"""
         # Hello {user_name}, <img src="{icon_img}" alt="EeeBee AI" style="width:55px; vertical-align:middle;"> EeeBee AI buddy is here to help you with :blue[{topic_name}]
@@ -1044,23 +1421,7 @@ def main_screen():
         # Teacher Mode
         tabs = st.tabs(["💬 Chat", "📊 Teacher Dashboard"])
         with tabs[0]:
-            st.subheader("Chat with your EeeBee AI buddy", anchor=None)
-            add_initial_greeting()
-            chat_container = st.container()
-            with chat_container:
-                chat_history_html = """
-                <div style="height: 400px; overflow-y: auto; border: 1px solid #ddd; padding: 10px; background-color: #f3f4f6; border-radius: 10px;">
-                """
-                for role, message in st.session_state.chat_history:
-                    if role == "assistant":
-                        chat_history_html += f"<div style='text-align: left; color: #000; background-color: #e0e7ff; padding: 8px; border-radius: 8px; margin-bottom: 5px;'><b>EeeBee:</b> {message}</div>"
-                    else:
-                        chat_history_html += f"<div style='text-align: left; color: #fff; background-color: #2563eb; padding: 8px; border-radius: 8px; margin-bottom: 5px;'><b>{user_name}:</b> {message}</div>"
-                chat_history_html += "</div>"
-                st.markdown(chat_history_html, unsafe_allow_html=True)
-            user_input = st.chat_input("Enter your question about the topic")
-            if user_input:
-                handle_user_input(user_input)
+            display_chat()
 
         with tabs[1]:
             st.subheader("Teacher Dashboard")
@@ -1072,53 +1433,39 @@ def main_screen():
             # English Student: only Chat
             tab1 = st.tabs(["💬 Chat"])[0]
             with tab1:
-                st.subheader("Chat with your EeeBee AI buddy", anchor=None)
-                add_initial_greeting()
-                chat_container = st.container()
-                with chat_container:
-                    chat_history_html = """
-                    <div style="height: 400px; overflow-y: auto; border: 1px solid #ddd; padding: 10px; background-color: #f3f4f6; border-radius: 10px;">
-                    """
-                    for role, message in st.session_state.chat_history:
-                        if role == "assistant":
-                            chat_history_html += f"<div style='text-align: left; color: #000; background-color: #e0e7ff; padding: 8px; border-radius: 8px; margin-bottom: 5px;'><b>EeeBee:</b> {message}</div>"
-                        else:
-                            chat_history_html += f"<div style='text-align: left; color: #fff; background-color: #2563eb; padding: 8px; border-radius: 8px; margin-bottom: 5px;'><b>{user_name}:</b> {message}</div>"
-                    chat_history_html += "</div>"
-                    st.markdown(chat_history_html, unsafe_allow_html=True)
-                user_input = st.chat_input("Enter your question about the topic")
-                if user_input:
-                    handle_user_input(user_input)
+                display_chat()
 
         else:
             # Non-English Student: Chat + Learning Path
             tab1, tab2 = st.tabs(["💬 Chat", "🧠 Learning Path"])
             with tab1:
-                st.subheader("Chat with your EeeBee AI buddy", anchor=None)
-                add_initial_greeting()
-                chat_container = st.container()
-                with chat_container:
-                    chat_history_html = """
-                    <div style="height: 400px; overflow-y: auto; border: 1px solid #ddd; padding: 10px; background-color: #f3f4f6; border-radius: 10px;">
-                    """
-                    for role, message in st.session_state.chat_history:
-                        if role == "assistant":
-                            chat_history_html += f"<div style='text-align: left; color: #000; background-color: #e0e7ff; padding: 8px; border-radius: 8px; margin-bottom: 5px;'><b>EeeBee:</b> {message}</div>"
-                        else:
-                            chat_history_html += f"<div style='text-align: left; color: #fff; background-color: #2563eb; padding: 8px; border-radius: 8px; margin-bottom: 5px;'><b>{user_name}:</b> {message}</div>"
-                    chat_history_html += "</div>"
-                    st.markdown(chat_history_html, unsafe_allow_html=True)
-                user_input = st.chat_input("Enter your question about the topic")
-                if user_input:
-                    handle_user_input(user_input)
+                display_chat()
 
             with tab2:
                 weak_concepts = st.session_state.auth_data.get("WeakConceptList", [])
-                concept_list = st.session_state.auth_data.get('ConceptList', [])
 
                 if not weak_concepts:
                     st.warning("No weak concepts found.")
                 else:
+                    missing = {
+                        concept["ConceptID"]: concept["ConceptText"]
+                        for concept in weak_concepts
+                        if concept["ConceptID"] not in st.session_state.student_learning_paths
+                    }
+                    if len(missing) > 1 and st.button("🧠 Generate All Learning Paths"):
+                        with st.spinner(f"Generating {len(missing)} learning paths..."):
+                            learning_paths = generate_learning_paths(list(missing.values()))
+                        for concept_id, concept_text in missing.items():
+                            learning_path = learning_paths.get(concept_text)
+                            if learning_path:
+                                st.session_state.student_learning_paths[concept_id] = {
+                                    "concept_text": concept_text,
+                                    "learning_path": learning_path
+                                }
+                                st.session_state[learning_path_toggle_key(concept_text)] = True
+                            else:
+                                st.error(f"Failed to generate learning path for {concept_text}.")
+
                     for idx, concept in enumerate(weak_concepts):
                         concept_text = concept.get("ConceptText", f"Concept {idx+1}")
                         concept_id = concept.get("ConceptID", f"id_{idx+1}")
@@ -1137,6 +1484,8 @@ def main_screen():
                                             "learning_path": learning_path
                                         }
                                         st.success(f"Learning path generated for {concept_text}!")
+                                        # Open the new learning path straight away
+                                        st.session_state[learning_path_toggle_key(concept_text)] = True
                                     else:
                                         st.error(f"Failed to generate learning path for {concept_text}.")
                             else:
@@ -1148,7 +1497,6 @@ def main_screen():
                             display_learning_path_with_resources(
                                 lp_data["concept_text"],
                                 lp_data["learning_path"],
-                                concept_list,
                                 st.session_state.topic_id
                             )
 # ================= MAIN APP LOGIC =================
@@ -1159,7 +1507,12 @@ def main():
     else:
         placeholder = st.empty()
         with placeholder.container():
-            login_screen()
+            logged_in = login_screen()
+        if logged_in:
+            # Swap the login form for the app in this same run rather than
+            # paying for a second full script run via st.rerun()
+            placeholder.empty()
+            main_screen()
 
 
 if __name__ == "__main__":